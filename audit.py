@@ -0,0 +1,216 @@
+'''
+Append-only audit log of the actions the bot took.
+
+Each record is a fixed size header (timestamp, payload length) followed by
+a JSON payload. Reads go through a memory map and are narrowed down with
+in-memory indexes by user, channel and command. The indexes are built by
+scanning the log on a background thread, so appending never waits on it.
+'''
+
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+HEADER = struct.Struct('<dI')
+
+
+class AuditRecord:
+    '''
+    A single entry in the audit log.
+    '''
+
+    def __init__(self, ts: float, kind: str, user: Optional[str], channel: Optional[str],
+                 command: str, args: List[List]) -> None:
+        self.ts = ts
+        self.kind = kind
+        self.user = user
+        self.channel = channel
+        self.command = command
+        self.args = args
+
+    def users(self):
+        '''
+        Returns every user this record should be found by.
+        '''
+        return ({self.user} | {val for typ, val in self.args if typ == 'USER'}) - {None}
+
+    def channels(self):
+        '''
+        Returns every channel this record should be found by.
+        '''
+        return ({self.channel} | {val for typ, val in self.args if typ == 'CHANNEL'}) - {None}
+
+    def __repr__(self):
+        return f'AuditRecord({self.ts}, {self.kind}, {self.user}, {self.command}, {self.args})'
+
+
+class AuditLog:
+    '''
+    An append-only log file with indexes held in memory.
+    '''
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.repaired = False
+        # Everything before this offset is indexed.
+        self.scanned = 0
+        self.mapped: Optional[mmap.mmap] = None
+        self.offsets: List[int] = []
+        self.by_user: Dict[str, List[int]] = defaultdict(list)
+        self.by_channel: Dict[str, List[int]] = defaultdict(list)
+        self.by_command: Dict[str, List[int]] = defaultdict(list)
+
+    def _index(self, offset: int, record: AuditRecord):
+        self.offsets.append(offset)
+        for user in record.users():
+            self.by_user[user].append(offset)
+        for channel in record.channels():
+            self.by_channel[channel].append(offset)
+        self.by_command[record.command].append(offset)
+
+    def _map(self):
+        '''
+        Maps the log into memory, remapping if it grew since last time.
+        '''
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if size == 0:
+            return None
+        if self.mapped is None or len(self.mapped) < size:
+            if self.mapped is not None:
+                self.mapped.close()
+            with open(self.path, 'rb') as log_file:
+                self.mapped = mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.mapped
+
+    @staticmethod
+    def _read(mapped: mmap.mmap, offset: int) -> AuditRecord:
+        ts, length = HEADER.unpack_from(mapped, offset)
+        start = offset + HEADER.size
+        payload = json.loads(mapped[start:start + length])
+        return AuditRecord(ts, **payload)
+
+    def _scan(self):
+        '''
+        Indexes every complete record past self.scanned.
+        '''
+        mapped = self._map()
+        if mapped is None:
+            return
+        offset = self.scanned
+        while offset + HEADER.size <= len(mapped):
+            _, length = HEADER.unpack_from(mapped, offset)
+            if offset + HEADER.size + length > len(mapped):
+                # A write in progress.
+                break
+            try:
+                self._index(offset, self._read(mapped, offset))
+            except (TypeError, ValueError):
+                logging.warning(f'skipping unreadable audit record at {offset}')
+            offset += HEADER.size + length
+        self.scanned = offset
+
+    def _load(self):
+        try:
+            # Most of the work happens without the lock so appends carry
+            # on, then we catch up on whatever was appended meanwhile.
+            self._scan()
+            with self.lock:
+                self._scan()
+        except:
+            # Better to answer from part of the log than to never answer.
+            logging.exception('could not load the audit log')
+        self.loaded = True
+
+    def _repair(self):
+        '''
+        Cuts off a record a crash left half written, so that the next
+        record starts where a reader expects one. Only walks the headers,
+        so it is quick enough to do before appending.
+        '''
+        self.repaired = True
+        mapped = self._map()
+        if mapped is None:
+            return
+        offset = 0
+        while offset + HEADER.size <= len(mapped):
+            _, length = HEADER.unpack_from(mapped, offset)
+            if offset + HEADER.size + length > len(mapped):
+                break
+            offset += HEADER.size + length
+        if offset < len(mapped):
+            logging.warning(f'truncating torn audit record at {offset}')
+            self.mapped.close()
+            self.mapped = None
+            os.truncate(self.path, offset)
+
+    def start(self):
+        '''
+        Repairs the log, then builds the indexes on a background thread.
+        '''
+        with self.lock:
+            self._repair()
+        threading.Thread(target=self._load, daemon=True).start()
+
+    def append(self, record: AuditRecord):
+        '''
+        Writes a record to the end of the log.
+        '''
+        payload = json.dumps({
+            'kind': record.kind,
+            'user': record.user,
+            'channel': record.channel,
+            'command': record.command,
+            'args': record.args,
+        }).encode()
+        with self.lock:
+            if not self.repaired:
+                self._repair()
+            with open(self.path, 'ab') as log_file:
+                offset = log_file.tell()
+                log_file.write(HEADER.pack(record.ts, len(payload)) + payload)
+                end = log_file.tell()
+            # Until we are loaded the scan picks new records up instead.
+            if self.loaded:
+                self._index(offset, record)
+                self.scanned = end
+
+    def query(self, user=None, channel=None, command=None,
+              limit=10) -> Optional[List[AuditRecord]]:
+        '''
+        Returns the newest limit records matching every given filter,
+        newest first, or None if the indexes are still being built.
+        '''
+        if not self.loaded:
+            return None
+        candidates = [index.get(key, []) for index, key in [
+            (self.by_user, user),
+            (self.by_channel, channel),
+            (self.by_command, command),
+        ] if key is not None]
+        if not candidates:
+            offsets = self.offsets
+        else:
+            # Walk the shortest index and check the others on the way.
+            offsets = min(candidates, key=len)
+
+        mapped = self._map()
+        records: List[AuditRecord] = []
+        for offset in reversed(offsets):
+            record = self._read(mapped, offset)
+            if user is not None and user not in record.users():
+                continue
+            if channel is not None and channel not in record.channels():
+                continue
+            if command is not None and command != record.command:
+                continue
+            records.append(record)
+            if len(records) >= limit:
+                break
+        return records
@@ -0,0 +1,147 @@
+'''
+Microbenchmarks for the code every message goes through.
+
+    python bench.py           # fail if anything regressed against the baseline
+    python bench.py --update  # record a new baseline
+
+Timings are machine specific, so record a baseline on the machine you
+compare on before trusting the results.
+'''
+
+import json
+import logging
+import os
+import sys
+import tempfile
+import timeit
+from operator import eq
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baseline.json')
+# How much slower than the baseline a benchmark may get before we fail.
+# Timings on a busy machine easily wobble by a third, so anything over
+# the threshold is measured again before we call it a regression.
+THRESHOLD = 1.5
+REPEAT = 5
+
+# DiskStore and friends write to the working directory on import.
+os.chdir(tempfile.mkdtemp())
+
+from commands import (ANY_CHANNEL, ANY_STRING, ANY_USER, SyncCommand,  # noqa: E402
+                      loose_cmp)
+from config import FORMAT  # noqa: E402
+from parser import parse_arguments  # noqa: E402
+from slack import get_reaction_sum  # noqa: E402
+from store import DiskStore  # noqa: E402
+from util import log  # noqa: E402
+
+
+def _messages():
+    short = '.help'.split()
+    vote = '.rename <#C052EM50K|waterloo> pickle'.split()
+    mixed = ('.intersect <#C052EM50K|waterloo> <@U088EGWEL> 5 '
+             '<mailto:a@b.com|a@b.com> .kick words ').split() * 8
+    return {'short': short, 'vote': vote, 'mixed': mixed}
+
+
+def _command_table(size):
+    table = [SyncCommand(f'.cmd{i}', [ANY_CHANNEL, ANY_STRING], None, cmp=loose_cmp)
+             for i in range(size - 1)]
+    table.append(SyncCommand('.target', [ANY_USER, ANY_CHANNEL], None, cmp=eq))
+    args = parse_arguments('.help <@U088EGWEL> <#C052EM50K|waterloo>'.split())
+    # Make the last command the one that matches so we scan the whole table.
+    args[0].val = '.target'
+    return table, args
+
+
+def _reactions(size):
+    names = ['+1', '-1', 'tada', 'eyes']
+    return {'message': {'reactions': [
+        {'name': names[i % len(names)], 'count': i % 7} for i in range(size)]}}
+
+
+def _benchmarks():
+    benchmarks = {}
+    for name, argv in _messages().items():
+        benchmarks[f'parse_arguments[{name}]'] = lambda argv=argv: parse_arguments(argv)
+
+    for size in [10, 100, 1000]:
+        table, args = _command_table(size)
+        benchmarks[f'matches[{size}]'] = (
+            lambda table=table, args=args: next(c for c in table if c.matches(args)))
+
+    matchers = [ANY_CHANNEL, ANY_STRING]
+    arguments = parse_arguments('<#C052EM50K|waterloo> pickle extra'.split())
+    benchmarks['loose_cmp'] = lambda: loose_cmp(matchers, arguments)
+
+    for size in [10, 1000, 10000]:
+        reactions = _reactions(size)
+        benchmarks[f'get_reaction_sum[{size}]'] = (
+            lambda reactions=reactions: get_reaction_sum(reactions))
+
+    DiskStore.set_value('bench', 1)
+    benchmarks['DiskStore.get_value'] = lambda: DiskStore.get_value('bench')
+    benchmarks['DiskStore.set_value'] = lambda: DiskStore.set_value('bench', 2)
+
+    def _plain(a, b):
+        return a + b
+    logged = log(_plain)
+    # Log the way production does, at DEBUG to a file, so that formatting
+    # and writing every line is part of what we measure.
+    logging.basicConfig(filename='bench.log', level=logging.DEBUG, format=FORMAT, force=True)
+    benchmarks['log[plain]'] = lambda: _plain(1, 2)
+    benchmarks['log[logged]'] = lambda: logged(1, 2)
+    return benchmarks
+
+
+def run(names=None):
+    '''
+    Returns the best time per call in microseconds for every benchmark,
+    or only those in names. Each sample runs the benchmark enough times
+    to take at least 0.2s.
+    '''
+    results = {}
+    for name, fn in _benchmarks().items():
+        if names is not None and name not in names:
+            continue
+        timer = timeit.Timer(fn)
+        number, _ = timer.autorange()
+        best = min(timer.repeat(number=number, repeat=REPEAT))
+        results[name] = best / number * 1e6
+    return results
+
+
+def main():
+    '''
+    Runs the benchmarks and either records or checks the baseline.
+    '''
+    results = run()
+    if '--update' in sys.argv:
+        with open(BASELINE, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+            baseline_file.write('\n')
+        print(f'wrote {BASELINE}')
+        return
+
+    with open(BASELINE) as baseline_file:
+        baseline = json.load(baseline_file)
+
+    suspects = [name for name, micros in results.items()
+                if name in baseline and micros / baseline[name] > THRESHOLD]
+    for name, micros in run(suspects).items():
+        results[name] = min(results[name], micros)
+
+    regressions = []
+    for name, micros in sorted(results.items()):
+        ratio = micros / baseline[name] if name in baseline else None
+        shown = f'{ratio:.2f}x' if ratio is not None else 'new'
+        print(f'{name:32} {micros:12.3f}us {shown:>8}')
+        if ratio is not None and ratio > THRESHOLD:
+            regressions.append(name)
+
+    if regressions:
+        print(f'regressed more than {THRESHOLD}x: {", ".join(regressions)}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
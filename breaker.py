@@ -0,0 +1,70 @@
+'''
+A circuit breaker so we stop waiting on Slack while it is having a bad time.
+'''
+
+import time
+from enum import Enum, auto
+
+
+class State(Enum):
+    '''
+    The states a circuit breaker moves between.
+    '''
+    CLOSED = auto()
+    OPEN = auto()
+    HALF_OPEN = auto()
+
+    def __str__(self):
+        return self.name
+
+
+class CircuitBreaker:
+    '''
+    Opens after threshold failures in a row. While open every call fails
+    fast until reset_timeout seconds have passed, after which a single
+    call is let through as a probe. A successful probe closes the breaker
+    and a failed one opens it again.
+    '''
+
+    def __init__(self, threshold: int, reset_timeout: float) -> None:
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = State.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+
+    def retry_at(self) -> float:
+        '''
+        Returns when the next probe will be let through.
+        '''
+        return self.opened_at + self.reset_timeout
+
+    def allow(self) -> bool:
+        '''
+        Returns true if a call may go ahead.
+        '''
+        if self.state == State.OPEN:
+            if time.time() < self.retry_at():
+                return False
+            self.state = State.HALF_OPEN
+            return True
+        if self.state == State.HALF_OPEN:
+            # Only the probe gets through until it reports back.
+            return False
+        return True
+
+    def success(self):
+        '''
+        Records a successful call.
+        '''
+        self.state = State.CLOSED
+        self.failures = 0
+
+    def failure(self):
+        '''
+        Records a failed call.
+        '''
+        self.failures += 1
+        if self.state == State.HALF_OPEN or self.failures >= self.threshold:
+            self.state = State.OPEN
+            self.opened_at = time.time()
@@ -2,23 +2,59 @@
 All commands and their metadata live in here.
 '''
 
+import logging
 import os
+import re
 import sys
+import threading
 import time
 from collections import namedtuple
-from functools import singledispatch
+from functools import lru_cache, singledispatch
 from operator import eq
 from typing import Dict, List
 
 import git
 
-from config import ADMIN
+import profiler
+from audit import AuditLog, AuditRecord
+from config import (ADMIN, AUDIT_LOG, MAX_LISTENING, MAX_PROFILE_SECONDS,
+                    OUTBOUND_WINDOW, PROGRESS_DELAY, SCHEDULE_DB,
+                    UPDATE_CHANNEL)
+from outbound import Outbox
 from parser import Argument, ArgumentMatcher, ArgumentType
-from slack import get_id
-from store import DiskStore
-from util import log
+from progress import ProgressUpdater
+from scheduler import Scheduler
+from slack import (ApiCallException, CircuitOpenException, TransientApiCallException,
+                   get_id)
+from store import DiskStore, VoteStore
+from util import format_duration, log, parse_duration, parse_time_of_day
 
 ListeningEvent = namedtuple('ListeningEvent', ['ts', 'fn'])
+PendingVote = namedtuple('PendingVote',
+                         ['ts', 'command', 'event', 'args', 'message', 'votes_required', 'plan'])
+
+# How often we try to carry out a passed vote before giving up, and how
+# long we wait before trying again if no circuit breaker tells us.
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 10
+
+# Seconds .update waits for git pull before giving up.
+GIT_TIMEOUT = 60
+
+# Most audit log entries .history will show at once.
+MAX_HISTORY = 50
+
+# Slack's rules for channel names.
+CHANNEL_NAME = re.compile(r'[a-z0-9_-]{1,21}')
+EMAIL = re.compile(r'[^@\s]+@[^@\s]+\.[^@\s]+')
+
+
+class PlanException(Exception):
+    '''
+    Used for when a vote command is bound to fail, so there is no point
+    voting on it.
+    '''
+    pass
 
 
 class Command:
@@ -60,14 +96,25 @@ class AdminCommand(Command):
     pass
 
 
+class DeferCommand(Command):
+    '''
+    A defer command schedules another command to run later on
+    behalf of whoever asked for it.
+    '''
+    pass
+
+
 class VoteCommand(Command):
     '''
     A vote command will start a vote and wait for enough
-    votes before running.
+    votes before running. plan resolves and validates everything
+    fn needs when the vote starts, so fn only has to act once it passes.
     '''
 
-    def __init__(self, name: str, args: List[ArgumentMatcher], fn, message, key, cmp=eq) -> None:
+    def __init__(self, name: str, args: List[ArgumentMatcher], plan, fn, message, key,
+                 cmp=eq) -> None:
         super(VoteCommand, self).__init__(name, args, fn, cmp)
+        self.plan = plan
         self.message = message
         self.key = key
         # Hacky work around.
@@ -76,6 +123,11 @@ class VoteCommand(Command):
 
 
 listening: Dict[str, ListeningEvent] = {}
+scheduler = Scheduler(SCHEDULE_DB)
+audit_log = AuditLog(AUDIT_LOG)
+vote_store = VoteStore()
+progress = ProgressUpdater(scheduler, PROGRESS_DELAY)
+outbox = Outbox(scheduler, OUTBOUND_WINDOW)
 
 
 def loose_cmp(matchers: List[ArgumentMatcher], arguments: List[Argument]):
@@ -87,6 +139,42 @@ def loose_cmp(matchers: List[ArgumentMatcher], arguments: List[Argument]):
     return matchers[:length] == arguments[:length]
 
 
+def reply(slack_client, channel, text):
+    '''
+    Sends text to channel, batched with any other replies to it sent
+    within OUTBOUND_WINDOW seconds.
+    '''
+    outbox.send(slack_client, channel, text)
+
+
+def delete(slack_client, event):
+    '''
+    Deletes the message event, trying again later if a circuit breaker
+    is open.
+    '''
+    try:
+        slack_client.delete_message(event)
+    except CircuitOpenException as circuit_open:
+        logging.warning(circuit_open)
+        scheduler.at(circuit_open.retry_at, lambda: delete(slack_client, event))
+    except ApiCallException as api_call_exception:
+        logging.warning(api_call_exception)
+
+
+def audit(kind: str, command: Command, event, args: List[Argument]):
+    '''
+    Records that something happened to command in the audit log.
+    '''
+    audit_log.append(AuditRecord(
+        time.time(),
+        kind,
+        event.get('user'),
+        event.get('channel'),
+        command.name,
+        [[str(arg.typ), arg.val] for arg in args[1:]]
+    ))
+
+
 @singledispatch
 @log
 def handler(command: Command, event, args: List[Argument], slack_client):
@@ -107,19 +195,148 @@ def _vote_handler(command: VoteCommand, event, args: List[Argument], slack_clien
     if channel != slack_client.admin_channel:
         return
 
+    try:
+        plan = command.plan(slack_client, channel, args)
+    except PlanException as plan_exception:
+        audit('rejected', command, event, args)
+        reply(slack_client, channel, f'{plan_exception}')
+        return
+
     votes_required = DiskStore.get_value(command.key)
+    ts = time.time()
     response = slack_client.send_message(
-        channel, f'{command.message(args)} {votes_required} votes required.')
+        channel, _progress_text(command, args, 0, votes_required, ts))
+    audit('opened', command, event, args)
+
+    vote = PendingVote(
+        ts,
+        command.name,
+        {'user': event.get('user'), 'channel': channel},
+        args,
+        {'channel': response['channel'], 'ts': response['ts']},
+        votes_required,
+        plan
+    )
+    event_id = get_id(response)
+    vote_store.put(event_id, vote)
+    _listen(slack_client, event_id, vote)
+
+
+def _progress_text(command: VoteCommand, args: List[Argument], votes, votes_required, ts,
+                   outcome=None) -> str:
+    '''
+    Returns the text of a vote prompt showing how far along it is.
+    '''
+    tally = f'{votes}/{votes_required} votes'
+    if outcome is not None:
+        return f'{command.message(args)} {outcome} with {tally}.'
+    expires_in = format_duration(ts + MAX_LISTENING - time.time())
+    return f'{command.message(args)} {tally}, expires in {expires_in}.'
+
+
+def _listen(slack_client, event_id, vote: PendingVote):
+    '''
+    Starts listening for reactions to a pending vote.
+    '''
+    command = next(cmd for cmd in COMMANDS
+                   if cmd.name == vote.command and isinstance(cmd, VoteCommand))
+    channel = vote.event['channel']
+    current_votes = 0
 
     def _handler():
-        current_votes = slack_client.get_reaction_sum(response)
-        if current_votes >= votes_required:
-            command.fn(slack_client, channel, args)
+        nonlocal current_votes
+        try:
+            current_votes = slack_client.get_reaction_sum(vote.message)
+        except CircuitOpenException as circuit_open:
+            # Count again once we can rather than waiting for the next reaction.
+            logging.warning(circuit_open)
+            scheduler.at(circuit_open.retry_at, lambda: check_vote(event_id))
+            return False
+        if current_votes >= vote.votes_required:
+            # Forget the vote before acting on it, so however acting on it
+            # goes it only ever passes once. Make sure it is still ours to
+            # forget, or whoever took over would never act on it.
+            slack_client.check_lease()
+            audit('passed', command, vote.event, vote.args)
+            vote_store.delete(event_id)
+            _execute(slack_client, command, channel, vote.plan)
+            progress.finish(slack_client, vote.message, _progress_text(
+                command, vote.args, current_votes, vote.votes_required, vote.ts, 'Passed'))
             return True
         else:
+            progress.update(slack_client, vote.message, _progress_text(
+                command, vote.args, current_votes, vote.votes_required, vote.ts))
             return False
 
-    listening[get_id(response)] = ListeningEvent(time.time(), _handler)
+    def _expire():
+        # Someone else may have dealt with the vote already.
+        if listening.pop(event_id, None) is None:
+            return
+        vote_store.delete(event_id)
+        # current_votes only knows about reactions since we started
+        # listening, e.g. none at all if we were restarted in the meantime.
+        # Whatever goes wrong, the prompt still has to say it expired.
+        try:
+            votes = slack_client.get_reaction_sum(vote.message)
+        except:
+            logging.exception('could not count the votes on an expired vote')
+            votes = current_votes
+        progress.finish(slack_client, vote.message, _progress_text(
+            command, vote.args, votes, vote.votes_required, vote.ts, 'Expired'))
+
+    listening[event_id] = ListeningEvent(vote.ts, _handler)
+    scheduler.at(vote.ts + MAX_LISTENING, _expire)
+
+
+def check_vote(event_id):
+    '''
+    Counts the votes on a pending vote, if it is still pending, and stops
+    listening once it passed.
+    '''
+    if event_id not in listening:
+        return
+    try:
+        if listening[event_id].fn():
+            del listening[event_id]
+    except ApiCallException as api_call_exception:
+        logging.warning(api_call_exception)
+
+
+def _execute(slack_client, command: VoteCommand, channel, plan, attempt=1):
+    '''
+    Carries out the plan of a passed vote, trying again later, up to
+    MAX_ATTEMPTS times, if the API is struggling.
+    '''
+    try:
+        command.fn(slack_client, channel, plan)
+    except TransientApiCallException as transient:
+        logging.warning(transient)
+        if attempt >= MAX_ATTEMPTS:
+            reply(slack_client, channel, f'`{command.name}` failed, giving up.')
+            return
+        if isinstance(transient, CircuitOpenException):
+            retry_at = transient.retry_at
+        else:
+            retry_at = time.time() + RETRY_DELAY * attempt
+        scheduler.at(retry_at, lambda: _execute(
+            slack_client, command, channel, plan, attempt + 1))
+    except ApiCallException as api_call_exception:
+        logging.warning(api_call_exception)
+        reply(slack_client, channel, f'`{command.name}` failed.')
+
+
+def restore_votes(slack_client):
+    '''
+    Makes listening match the pending votes in the vote store. Safe to
+    call repeatedly, e.g. to keep a standby instance warm.
+    '''
+    votes = vote_store.all()
+    for event_id in list(listening):
+        if event_id not in votes:
+            del listening[event_id]
+    for event_id, vote in votes.items():
+        if event_id not in listening:
+            _listen(slack_client, event_id, vote)
 
 
 @handler.register(SyncCommand)
@@ -138,76 +355,199 @@ def _admin_handler(command: AdminCommand, event, args: List[Argument], slack_cli
     Handles admin level commands.
     '''
     if event['user'] == slack_client.get_user_by_name(ADMIN):
+        audit('ran', command, event, args)
         command.fn(slack_client, event['channel'], args)
     else:
-        slack_client.delete_message(event)
+        audit('denied', command, event, args)
+        delete(slack_client, event)
 
 
-def vote_fn(slack_client, channel, args: List[Argument]):
+@handler.register(DeferCommand)
+@log
+def _defer_handler(command: DeferCommand, event, args: List[Argument], slack_client):
     '''
-    Changes the number of votes required.
+    Handles commands which schedule other commands.
+    '''
+    command.fn(slack_client, event['channel'], args, event.get('user'))
+
+
+def find_command(args: List[Argument]):
+    '''
+    Returns the first command which matches args, or None.
+    '''
+    for command in COMMANDS:
+        if command.matches(args):
+            return command
+    return None
+
+
+def dispatch_deferred(slack_client, payload):
+    '''
+    Runs a command which was scheduled with .in or .at.
+    '''
+    channel, user, args = payload
+    command = find_command(args)
+    if command is not None:
+        handler(command, {'channel': channel, 'user': user}, args, slack_client)
+
+
+def _defer(slack_client, channel, args: List[Argument], user, deadline):
+    '''
+    Schedules the command in args[2:] to run at deadline on behalf of user.
+    '''
+    deferred = args[2:]
+    command = find_command(deferred)
+    if deadline is None or command is None or isinstance(command, AdminCommand):
+        reply(slack_client, channel, 'Could not schedule that.')
+        return
+
+    scheduler.persist(deadline, (channel, user, deferred))
+    when = time.strftime('%Y-%m-%d %H:%M', time.localtime(deadline))
+    reply(slack_client, channel, f'Scheduled `{command.name}` for {when}.')
+
+
+def in_fn(slack_client, channel, args: List[Argument], user):
+    '''
+    Runs a command after a delay such as 2h.
+    '''
+    duration = parse_duration(args[1].val)
+    deadline = None if duration is None else time.time() + duration
+    _defer(slack_client, channel, args, user, deadline)
+
+
+def at_fn(slack_client, channel, args: List[Argument], user):
+    '''
+    Runs a command at the next occurence of a time of day such as 17:00.
+    '''
+    _defer(slack_client, channel, args, user, parse_time_of_day(args[1].val))
+
+
+def vote_plan(slack_client, channel, args: List[Argument]):
+    '''
+    Plans changing the number of votes required.
     '''
     command_name = args[1].val
     new_value = args[2].val
+    if new_value < 1:
+        raise PlanException('Commands must require at least 1 vote.')
 
     command = next(cmd for cmd in COMMANDS if cmd.name == command_name)
     if not isinstance(command, VoteCommand):
         raise Exception('should never happen')
 
-    DiskStore.set_value(command.key, new_value)
-    slack_client.send_message(
-        channel, f'Changed `{command_name}` to require {new_value} votes.')
+    return {'command_name': command_name, 'key': command.key, 'new_value': new_value}
 
 
-def rename_fn(slack_client, channel, args: List[Argument]):
+def vote_fn(slack_client, channel, plan):
     '''
-    Changes the name of a channel.
+    Changes the number of votes required.
+    '''
+    DiskStore.set_value(plan['key'], plan['new_value'])
+    render_help.cache_clear()
+    reply(slack_client, channel,
+          f'Changed `{plan["command_name"]}` to require {plan["new_value"]} votes.')
+
+
+def rename_plan(slack_client, channel, args: List[Argument]):
+    '''
+    Plans renaming a channel. Slack has no dry run for renames, so we
+    check its naming rules and that the name is free ourselves.
     '''
     channel_id = args[1].val
-    new_name = args[2].val
-    original_name = slack_client.get_channel_name(channel_id)
+    new_name = args[2].val.replace('#', '')
+    if not CHANNEL_NAME.fullmatch(new_name):
+        raise PlanException(
+            f'{new_name} is not a valid channel name. Use up to 21 lowercase '
+            'letters, numbers, hyphens and underscores.')
+    if channel_id not in slack_client.membership.members:
+        raise PlanException(f'I am not in <#{channel_id}>.')
+    if slack_client.channel_name_exists(new_name):
+        raise PlanException(f'#{new_name} is already taken.')
+
+    return {
+        'channel_id': channel_id,
+        'new_name': new_name,
+        'original_name': slack_client.get_channel_name(channel_id),
+    }
+
 
+def rename_fn(slack_client, channel, plan):
+    '''
+    Changes the name of a channel.
+    '''
+    channel_id = plan['channel_id']
+    new_name = plan['new_name']
     response = slack_client.rename_channel(channel_id, new_name)
     if not response['ok']:
-        slack_client.send_message(
-            channel, f'Could not rename <#{channel_id}> to {new_name}.')
+        reply(
+            slack_client, channel, f'Could not rename <#{channel_id}> to {new_name}.')
     else:
-        slack_client.send_message(
-            channel, f'Renamed <#{channel_id}> from #{original_name} to {new_name}.')
+        reply(slack_client, channel,
+              f'Renamed <#{channel_id}> from #{plan["original_name"]} to {new_name}.')
 
 
-def kick_fn(slack_client, channel, args: List[Argument]):
+def kick_plan(slack_client, channel, args: List[Argument]):
     '''
-    Kicks a user from a channel.
+    Plans kicking a user from a channel.
     '''
     user = args[1].val
     chan = args[2].val
+    if chan not in slack_client.membership.members:
+        raise PlanException(f'I am not in <#{chan}>.')
+    if user not in slack_client.get_users_in_channel(chan):
+        raise PlanException(f'<@{user}> is not in <#{chan}>.')
+    if user == slack_client.self:
+        raise PlanException('I can not kick myself.')
+
+    return {'user': user, 'channel': chan}
+
+
+def kick_fn(slack_client, channel, plan):
+    '''
+    Kicks a user from a channel.
+    '''
+    user = plan['user']
+    chan = plan['channel']
     response = slack_client.kick_user(user, chan)
     if not response['ok']:
-        slack_client.send_message(
-            channel, f'Could not kick <@{user}> from <#{chan}>.')
+        reply(
+            slack_client, channel, f'Could not kick <@{user}> from <#{chan}>.')
     else:
-        slack_client.send_message(
-            channel, f'Kicked <@{user}> from <#{chan}>.')
+        reply(
+            slack_client, channel, f'Kicked <@{user}> from <#{chan}>.')
 
 
-def invite_fn(slack_client, channel, args: List[Argument]):
+def invite_plan(slack_client, channel, args: List[Argument]):
     '''
-    Invites a user to this slack.
+    Plans inviting a user to this slack.
     '''
     email = args[1].val
+    if not EMAIL.fullmatch(email):
+        raise PlanException(f'{email} is not a valid email address.')
+
+    return {'email': email}
+
+
+def invite_fn(slack_client, channel, plan):
+    '''
+    Invites a user to this slack.
+    '''
+    email = plan['email']
     response = slack_client.invite_email(email)
     if not response['ok']:
-        slack_client.send_message(
-            channel, f'Could not invite <mailto:{email}> to this slack.')
+        reply(
+            slack_client, channel, f'Could not invite <mailto:{email}> to this slack.')
     else:
-        slack_client.send_message(
-            channel, f'Invited <mailto:{email}> to this slack.')
+        reply(
+            slack_client, channel, f'Invited <mailto:{email}> to this slack.')
 
 
-def help_fn(slack_client, channel, args: List[Argument]):
+@lru_cache(maxsize=1)
+def render_help() -> str:
     '''
-    Outputs a help message.
+    Returns the help message. It is cached since it reads every vote
+    threshold from disk, so call render_help.cache_clear() when one
+    changes.
     '''
     help_message = 'Actions are voted on using :+1: and :-1:. I support the following commands:```'
     for cmd in COMMANDS:
@@ -221,21 +561,28 @@ def help_fn(slack_client, channel, args: List[Argument]):
         help_message += line
 
     help_message += "```"
-    slack_client.send_message(channel, help_message)
+    return help_message
+
+
+def help_fn(slack_client, channel, args: List[Argument]):
+    '''
+    Outputs a help message.
+    '''
+    reply(slack_client, channel, render_help())
 
 
 def pong_fn(slack_client, channel, args: List[Argument]):
     '''
     Outputs a pong.
     '''
-    slack_client.send_message(channel, 'pong')
+    reply(slack_client, channel, 'pong')
 
 
 def ping_fn(slack_client, channel, args: List[Argument]):
     '''
     Outputs a ping.
     '''
-    slack_client.send_message(channel, 'ping')
+    reply(slack_client, channel, 'ping')
 
 
 def update_fn(slack_client, channel, args: List[Argument]):
@@ -244,15 +591,64 @@ def update_fn(slack_client, channel, args: List[Argument]):
     '''
     g = git.cmd.Git('.')
     try:
-        g.pull()
+        g.pull(kill_after_timeout=GIT_TIMEOUT)
     except:
-        slack_client.send_message(channel, f'Could not git pull.')
+        reply(slack_client, channel, f'Could not git pull.')
         return
 
+    # Replies still waiting in the outbox would be lost with the process.
+    outbox.flush_all()
     # This will not return. Instead, the process will be immediately replaced.
     os.execl(sys.executable, *([sys.executable] + sys.argv))
 
 
+# Held while a .profile or .memory run is in progress. Overlapping runs
+# would skew each other and share tracemalloc's state.
+profiling = threading.Lock()
+
+
+def _in_background(slack_client, channel, args: List[Argument], name, fn):
+    '''
+    Runs fn for args[1] seconds on a separate thread, so it can watch the
+    main loop, and uploads what it returns to UPDATE_CHANNEL.
+    '''
+    seconds = min(args[1].val, MAX_PROFILE_SECONDS)
+    if seconds <= 0:
+        reply(slack_client, channel, 'Seconds must be positive.')
+        return
+    if not profiling.acquire(blocking=False):
+        reply(slack_client, channel, 'Already running.')
+        return
+
+    def _run():
+        try:
+            content = fn(seconds)
+            slack_client.upload_file(UPDATE_CHANNEL, f'{name}.folded', content or 'No samples.')
+        except:
+            logging.exception(f'{name} failed')
+        finally:
+            profiling.release()
+
+    threading.Thread(target=_run, daemon=True).start()
+    reply(slack_client, channel, f'Running {name} for {seconds} seconds.')
+
+
+def profile_fn(slack_client, channel, args: List[Argument]):
+    '''
+    Samples the main thread's stack and uploads the top stacks.
+    '''
+    thread_id = threading.get_ident()
+    _in_background(slack_client, channel, args, 'profile',
+                   lambda seconds: profiler.collapse(profiler.sample_stacks(thread_id, seconds)))
+
+
+def memory_fn(slack_client, channel, args: List[Argument]):
+    '''
+    Diffs two tracemalloc snapshots and uploads the top allocation sites.
+    '''
+    _in_background(slack_client, channel, args, 'memory', profiler.allocation_diff)
+
+
 def _intersect(slack_client, channel, lennahc) -> str:
     '''
     Returns a formatted string of users in channel and lennahc.
@@ -269,12 +665,48 @@ def _intersect(slack_client, channel, lennahc) -> str:
     return line
 
 
+def _format_record(record: AuditRecord) -> str:
+    '''
+    Returns a single line describing an audit record.
+    '''
+    when = time.strftime('%Y-%m-%d %H:%M', time.localtime(record.ts))
+    args = ' '.join(str(val) for _, val in record.args)
+    return f'{when} {record.user or "-"} {record.kind} {record.command} {args}'.rstrip()
+
+
+def history_fn(slack_client, channel, args: List[Argument]):
+    '''
+    Outputs recent audit log entries, optionally filtered by a user,
+    channel, command and a number of entries.
+    '''
+    filters = {'limit': 10}
+    for arg in args[1:]:
+        if arg.typ == ArgumentType.USER:
+            filters['user'] = arg.val
+        elif arg.typ == ArgumentType.CHANNEL:
+            filters['channel'] = arg.val
+        elif arg.typ in (ArgumentType.COMMAND, ArgumentType.VOTING_COMMAND):
+            filters['command'] = arg.val
+        elif arg.typ == ArgumentType.INT:
+            filters['limit'] = max(1, min(arg.val, MAX_HISTORY))
+
+    records = audit_log.query(**filters)
+    if records is None:
+        reply(slack_client, channel, 'History is still loading.')
+        return
+    if not records:
+        reply(slack_client, channel, 'No history.')
+        return
+    lines = '\n'.join(_format_record(record) for record in records)
+    reply(slack_client, channel, f'```{lines}```')
+
+
 def intersect_fn(slack_client, channel, args: List[Argument]):
     '''
     Gets the intersection of two channels users and pings them.
     '''
     intersection = _intersect(slack_client, args[1].val, args[2].val)
-    slack_client.send_message(channel, intersection)
+    reply(slack_client, channel, intersection)
 
 
 def intersect_short_fn(slack_client, channel, args: List[Argument]):
@@ -283,7 +715,17 @@ def intersect_short_fn(slack_client, channel, args: List[Argument]):
     the intersection.
     '''
     intersection = _intersect(slack_client, args[1].val, channel)
-    slack_client.send_message(channel, intersection)
+    reply(slack_client, channel, intersection)
+
+
+def channels_fn(slack_client, channel, args: List[Argument]):
+    '''
+    Lists the channels a user shares with us.
+    '''
+    user = args[1].val
+    channels = slack_client.get_channels_for_user(user)
+    line = ' '.join(f'<#{chan}>' for chan in sorted(channels))
+    reply(slack_client, channel, line or 'No channels.')
 
 
 ANY_CHANNEL = ArgumentMatcher(ArgumentType.CHANNEL)
@@ -298,6 +740,11 @@ COMMANDS: List[Command] = [
     SyncCommand('.ping', [], pong_fn),
     SyncCommand('.pong', [], ping_fn),
     AdminCommand('.update', [], update_fn),
+    AdminCommand('.profile', [ANY_INT], profile_fn),
+    AdminCommand('.memory', [ANY_INT], memory_fn),
+    DeferCommand('.in', [ANY_STRING], in_fn, cmp=loose_cmp),
+    SyncCommand('.history', [], history_fn, cmp=loose_cmp),
+    DeferCommand('.at', [ANY_STRING], at_fn, cmp=loose_cmp),
     SyncCommand(
         '.intersect',
         [ANY_CHANNEL],
@@ -310,9 +757,11 @@ COMMANDS: List[Command] = [
         intersect_fn,
         cmp=loose_cmp
     ),
+    SyncCommand('.channels', [ANY_USER], channels_fn),
     VoteCommand(
         '.vote',
         [ANY_VOTE_COMMAND, ANY_INT],
+        vote_plan,
         vote_fn,
         lambda args: f'Change `{args[1]}` to require {args[2]} votes?',
         'vote'
@@ -320,6 +769,7 @@ COMMANDS: List[Command] = [
     VoteCommand(
         '.rename',
         [ANY_CHANNEL, ANY_STRING],
+        rename_plan,
         rename_fn,
         lambda args: f'Rename <#{args[1]}> to {args[2]}?',
         'rename'
@@ -327,6 +777,7 @@ COMMANDS: List[Command] = [
     VoteCommand(
         '.kick',
         [ANY_USER, ANY_CHANNEL],
+        kick_plan,
         kick_fn,
         lambda args: f'Kick <@{args[1]}> from <#{args[2]}>?',
         'kick'
@@ -334,6 +785,7 @@ COMMANDS: List[Command] = [
     VoteCommand(
         '.invite',
         [ANY_EMAIL],
+        invite_plan,
         invite_fn,
         lambda args: f'Invite <mailto:{args[1]}> to this slack?',
         'invite'
@@ -0,0 +1,180 @@
+'''
+Slack Events API receiver, an alternative to reading events over RTM.
+
+Requests are verified against the signing secret, acknowledged straight
+away and their events queued for the main loop. GET /health only succeeds
+on the active instance, so a load balancer can keep Slack's requests away
+from standbys. To try it locally, start
+the bot with INGEST = 'events' and post a signed fake event with:
+
+    python events.py http://localhost:3000 '{"type": "message", ...}'
+'''
+
+import hashlib
+import hmac
+import json
+import logging
+import queue
+import sys
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Tuple
+
+# Slack recommends rejecting requests older than five minutes.
+MAX_REQUEST_AGE = 60 * 5
+MAX_SEEN_EVENTS = 1000
+
+
+def sign(secret: str, timestamp, body: bytes) -> str:
+    '''
+    Returns the X-Slack-Signature for body sent at timestamp.
+    '''
+    base = f'v0:{timestamp}:'.encode() + body
+    return 'v0=' + hmac.new(secret.encode(), base, hashlib.sha256).hexdigest()
+
+
+def verify(secret: str, timestamp, signature, body: bytes) -> bool:
+    '''
+    Returns true if signature is valid for body and timestamp is recent.
+    '''
+    try:
+        age = abs(time.time() - int(timestamp))
+    except (TypeError, ValueError):
+        return False
+    if age > MAX_REQUEST_AGE:
+        return False
+    return hmac.compare_digest(sign(secret, timestamp, body), signature or '')
+
+
+class EventReceiver:
+    '''
+    Receives events over HTTP and puts them on a queue.
+    '''
+
+    def __init__(self, secret: str, port: int) -> None:
+        self.secret = secret
+        self.port = port
+        self.events: queue.Queue = queue.Queue()
+        self.seen: 'OrderedDict[str, None]' = OrderedDict()
+        self.lock = threading.Lock()
+        # Only the active instance passes health checks. Events which reach
+        # a standby anyway are acknowledged, since Slack disables apps which
+        # fail too many deliveries, but dropped. By the time the standby
+        # took over they could be hours old.
+        self.active = True
+
+    def _is_duplicate(self, event_id) -> bool:
+        '''
+        Returns true if event_id was already queued. Slack retries events
+        it thinks we missed.
+        '''
+        if event_id is None:
+            return False
+        with self.lock:
+            if event_id in self.seen:
+                return True
+            self.seen[event_id] = None
+            if len(self.seen) > MAX_SEEN_EVENTS:
+                self.seen.popitem(last=False)
+        return False
+
+    def handle(self, headers: Dict[str, str], body: bytes) -> Tuple[int, bytes]:
+        '''
+        Handles a single request, returning a status code and body.
+        '''
+        if not verify(self.secret, headers.get('X-Slack-Request-Timestamp'),
+                      headers.get('X-Slack-Signature'), body):
+            return 401, b''
+
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return 400, b''
+        if not isinstance(payload, dict):
+            return 400, b''
+
+        payload_type = payload.get('type', None)
+        if payload_type == 'url_verification':
+            return 200, payload.get('challenge', '').encode()
+        if payload_type == 'event_callback' and 'event' in payload:
+            if not self.active:
+                logging.warning('dropped an event sent to a standby')
+            elif not self._is_duplicate(payload.get('event_id', None)):
+                self.events.put(payload['event'])
+        return 200, b''
+
+    def health(self) -> Tuple[int, bytes]:
+        '''
+        Returns a status code saying whether we are the active instance.
+        '''
+        if self.active:
+            return 200, b'active'
+        return 503, b'standby'
+
+    def drain(self) -> int:
+        '''
+        Throws away every queued event, returning how many there were.
+        '''
+        count = 0
+        while True:
+            try:
+                self.events.get_nowait()
+            except queue.Empty:
+                return count
+            count += 1
+
+    def start(self):
+        '''
+        Serves requests on a background thread.
+        '''
+        receiver = self
+
+        class _RequestHandler(BaseHTTPRequestHandler):
+            def _respond(self, status, body):
+                self.send_response(status)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path == '/health':
+                    self._respond(*receiver.health())
+                else:
+                    self._respond(404, b'')
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                self._respond(*receiver.handle(self.headers, self.rfile.read(length)))
+
+            def log_message(self, format, *args):
+                logging.debug(format % args)
+
+        server = ThreadingHTTPServer(('', self.port), _RequestHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+def send_fake_event(url: str, secret: str, event: dict):
+    '''
+    Posts event to url the same way Slack would.
+    '''
+    body = json.dumps({
+        'type': 'event_callback',
+        'event_id': f'Ev{time.time()}',
+        'event': event,
+    }).encode()
+    timestamp = int(time.time())
+    request = urllib.request.Request(url, data=body, headers={
+        'Content-Type': 'application/json',
+        'X-Slack-Request-Timestamp': str(timestamp),
+        'X-Slack-Signature': sign(secret, timestamp, body),
+    })
+    with urllib.request.urlopen(request) as response:
+        return response.status
+
+
+if __name__ == '__main__':
+    from config import SLACK_SIGNING_SECRET
+    print(send_fake_event(sys.argv[1], SLACK_SIGNING_SECRET, json.loads(sys.argv[2])))
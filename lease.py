@@ -0,0 +1,90 @@
+'''
+A lease held in a shared SQLite file so that only one instance processes
+events at a time while the others wait on standby.
+'''
+
+import os
+import socket
+import sqlite3
+import time
+
+
+class LeaseLostException(Exception):
+    '''
+    Used for when we find out we are no longer the active instance.
+    '''
+    pass
+
+
+class Lease:
+    '''
+    A named lease which expires ttl seconds after it was last renewed.
+
+    Other instances only take the lease over once it has expired, and the
+    holder stops treating itself as active once less than a third of the
+    ttl is left. The holder checks held() right before every call which
+    changes the workspace, so a third of the ttl must exceed the longest
+    a single such call can take.
+    '''
+
+    def __init__(self, path: str, name: str, ttl: float) -> None:
+        self.path = path
+        self.name = name
+        self.ttl = ttl
+        self.holder = f'{socket.gethostname()}:{os.getpid()}'
+        self.expires = 0.0
+        self.connection = sqlite3.connect(path, isolation_level=None)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS lease (name TEXT PRIMARY KEY, holder TEXT, expires REAL)')
+
+    def acquire(self) -> bool:
+        '''
+        Takes or renews the lease. Returns true if we hold it afterwards.
+        '''
+        now = time.time()
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = self.connection.execute(
+                'SELECT holder, expires FROM lease WHERE name = ?', (self.name,)).fetchone()
+            if row is not None and row[0] != self.holder and row[1] > now:
+                self.connection.execute('ROLLBACK')
+                return False
+            self.connection.execute(
+                'INSERT OR REPLACE INTO lease (name, holder, expires) VALUES (?, ?, ?)',
+                (self.name, self.holder, now + self.ttl))
+            self.connection.execute('COMMIT')
+        except:
+            self.connection.execute('ROLLBACK')
+            raise
+        self.expires = now + self.ttl
+        return True
+
+    def held(self) -> bool:
+        '''
+        Returns true if we may keep acting as the active instance.
+        '''
+        return time.time() < self.expires - self.ttl / 3
+
+    def renew(self):
+        '''
+        Renews the lease once a third of it has been used up. Raises
+        LeaseLostException if we are no longer allowed to be active.
+        '''
+        if time.time() > self.expires - self.ttl * 2 / 3:
+            try:
+                if not self.acquire():
+                    raise LeaseLostException(self.name)
+            except sqlite3.OperationalError:
+                # The file is busy, we will try again on the next call
+                # as long as there is time left.
+                pass
+        if not self.held():
+            raise LeaseLostException(self.name)
+
+    def release(self):
+        '''
+        Gives the lease up so a standby can take over straight away.
+        '''
+        self.connection.execute(
+            'DELETE FROM lease WHERE name = ? AND holder = ?', (self.name, self.holder))
+        self.expires = 0.0
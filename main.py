@@ -6,28 +6,45 @@ looks decent to me.
 '''
 
 import logging
+import queue
 import time
-from commands import COMMANDS, handler, listening
-
-import schedule
-
-from config import (MAX_LISTENING, SLACK_TOKEN, SLEEP_TIME, UPDATE_CHANNEL,
+from typing import Optional
+from commands import (COMMANDS, DeferCommand, audit_log, check_vote, delete,
+                      dispatch_deferred, find_command, handler, outbox,
+                      restore_votes, scheduler)
+
+from config import (API_TIMEOUT, EVENTS_PORT, HA, INGEST, LEASE_TTL, RATE_LIMIT,
+                    RATE_LIMIT_USERS, RATE_LIMITS, SLACK_SIGNING_SECRET,
+                    SLACK_TOKEN, SLEEP_TIME, STATE_DB, UPDATE_CHANNEL,
                     configure_logging)
+from events import EventReceiver
+from lease import Lease, LeaseLostException
 from parser import parse_arguments
+from ratelimit import RateLimiter
 from slack import ApiCallException, Client, get_id
 
+rate_limiter = RateLimiter(RATE_LIMITS, RATE_LIMIT, RATE_LIMIT_USERS)
+# How often a standby checks whether the lease is up for grabs, in seconds.
+STANDBY_POLL = 1
+
+# Every command starts with this. Anything else is chat, which must not
+# use up anyone's command quota.
+COMMAND_PREFIX = '.'
+DEFER_COMMANDS = {command.name for command in COMMANDS
+                  if isinstance(command, DeferCommand)}
+
 
-def prune_listening():
+def quota_name(argv) -> Optional[str]:
     '''
-    Iterates over listening and removes all events which are older
-    than MAX_LISTENING seconds.
+    Returns the command argv counts against, or None if it is not a
+    command and counts against nothing. Deferring a command counts
+    against the command itself, e.g. .in 2h .kick counts as a .kick.
     '''
-    expired_events = []
-    for key, val in listening.items():
-        if time.time() - val.ts > MAX_LISTENING:
-            expired_events.append(key)
-    for expired_event in expired_events:
-        del listening[expired_event]
+    if not argv or not argv[0].startswith(COMMAND_PREFIX):
+        return None
+    while len(argv) > 2 and argv[0] in DEFER_COMMANDS:
+        argv = argv[2:]
+    return argv[0]
 
 
 def process_event(slack_client, event):
@@ -50,47 +67,112 @@ def process_event(slack_client, event):
         if event['user'] == slack_client.self:
             return
 
+        # Drop floods before spending any lookups or API calls on them.
+        argv = event['text'].split()
+        name = quota_name(argv)
+        if name is not None and not rate_limiter.allow(event['user'], name):
+            logging.warning(f'rate limited {event["user"]}')
+            return
+
         # Ignore bot users.
         if slack_client.is_bot(event['user']):
-            slack_client.delete_message(event)
+            delete(slack_client, event)
             return
 
-        argv = event['text'].split()
         parsed_args = parse_arguments(argv)
-        for command in COMMANDS:
-            if command.matches(parsed_args):
-                handler(command, event, parsed_args, slack_client)
-                return
+        command = find_command(parsed_args)
+        if command is not None:
+            handler(command, event, parsed_args, slack_client)
+            return
 
         # Probably not a valid command
-        slack_client.delete_message(event)
-    elif event_type == 'reaction_added':
+        delete(slack_client, event)
+    elif event_type in ('reaction_added', 'reaction_removed'):
+        # Removing a :-1: can pass a vote too.
         item = event['item']
         if 'channel' in item and 'ts' in item:
-            event_id = get_id(event['item'])
-            if event_id in listening:
-                if listening[event_id].fn():
-                    del listening[event_id]
+            check_vote(get_id(event['item']))
+    elif event_type in ('user_change', 'team_join'):
+        slack_client.on_user_changed(event['user'])
+    elif event_type == 'member_joined_channel':
+        slack_client.on_member_joined(event['user'], event['channel'])
+    elif event_type == 'member_left_channel':
+        slack_client.on_member_left(event['user'], event['channel'])
+
+
+def handle_event(slack_client, event):
+    '''
+    Processes a single event, logging failed API calls. Events are never
+    replayed, since part of one may already have happened. The steps
+    worth retrying, like acting on a passed vote or sending a reply,
+    retry themselves.
+    '''
+    try:
+        process_event(slack_client, event)
+    except ApiCallException as api_call_exception:
+        logging.warning(api_call_exception)
 
 
-def run(slack_client):
+def run(slack_client, lease):
     '''
     Main event loop.
     '''
     if slack_client.rtm_connect():
+        # Anything could have changed while we were disconnected.
+        slack_client.seed_membership()
+        guard = lease.renew if lease is not None else None
         while True:
+            if lease is not None:
+                lease.renew()
             events = slack_client.rtm_read()
             for event in events:
-                try:
-                    process_event(slack_client, event)
-                except ApiCallException as api_call_exception:
-                    logging.warning(api_call_exception)
-            schedule.run_pending()
-            time.sleep(SLEEP_TIME)
+                # Any event could be the one that outlasts the lease.
+                if lease is not None:
+                    lease.renew()
+                handle_event(slack_client, event)
+            scheduler.run_pending(guard)
+            time.sleep(scheduler.idle_time(SLEEP_TIME))
     else:
         raise ConnectionError()
 
 
+def run_events(slack_client, receiver, lease):
+    '''
+    Main event loop when events come from the Events API.
+    '''
+    # Anything still queued is from before we last lost the lease.
+    dropped = receiver.drain()
+    if dropped:
+        logging.warning(f'dropped {dropped} events queued before losing the lease')
+    receiver.active = True
+    slack_client.seed_membership()
+    guard = lease.renew if lease is not None else None
+    while True:
+        if lease is not None:
+            lease.renew()
+        try:
+            event = receiver.events.get(timeout=scheduler.idle_time(SLEEP_TIME))
+            # Waiting for the event may have used the lease up.
+            if lease is not None:
+                lease.renew()
+            handle_event(slack_client, event)
+        except queue.Empty:
+            pass
+        scheduler.run_pending(guard)
+
+
+def standby(slack_client, lease):
+    '''
+    Waits until we hold the lease, keeping the pending votes warm so we
+    can take over straight away.
+    '''
+    logging.info('waiting for lease')
+    while not lease.acquire():
+        restore_votes(slack_client)
+        time.sleep(STANDBY_POLL)
+    logging.info('acquired lease')
+
+
 def main():
     '''
     Starts the program and event loop, etc.
@@ -98,21 +180,57 @@ def main():
     configure_logging()
 
     slack_client = Client(SLACK_TOKEN)
+    audit_log.start()
 
-    schedule.every().hour.do(prune_listening)
+    receiver = None
+    if INGEST == 'events':
+        receiver = EventReceiver(SLACK_SIGNING_SECRET, EVENTS_PORT)
+        receiver.start()
+    else:
+        # Not sure if this is useful yet. Might assure that we
+        # reconnect to slack if we ever disconnect.
+        scheduler.every(60, slack_client.ping)
 
-    # Not sure if this is useful yet. Might assure that we
-    # reconnect to slack if we ever disconnect.
-    schedule.every().minute.do(slack_client.ping)
+    def _dispatch(payload):
+        try:
+            dispatch_deferred(slack_client, payload)
+        except ApiCallException as api_call_exception:
+            logging.warning(api_call_exception)
+
+    lease = None
+    if HA:
+        # The lease is checked before every call which changes the
+        # workspace, and any one of them has to fit in its last third.
+        if LEASE_TTL / 3 <= API_TIMEOUT:
+            raise ValueError('LEASE_TTL / 3 must exceed API_TIMEOUT')
+        lease = Lease(STATE_DB, 'pyadmin', LEASE_TTL)
+        slack_client.lease = lease
 
     while True:
         try:
+            if receiver is not None:
+                receiver.active = False
+            if lease is not None:
+                standby(slack_client, lease)
+            scheduler.load(_dispatch)
+            restore_votes(slack_client)
+
             slack_client.send_message(UPDATE_CHANNEL, 'Started.')
-            run(slack_client)
+            if receiver is not None:
+                run_events(slack_client, receiver, lease)
+            else:
+                run(slack_client, lease)
+        except LeaseLostException:
+            logging.warning('lost lease')
+            # Replies to work we already did, which no one else will send.
+            outbox.flush_all()
         except ConnectionError:
             logging.warning('could not connect to slack')
             time.sleep(10)
         except KeyboardInterrupt:
+            outbox.flush_all()
+            if lease is not None:
+                lease.release()
             break
         except:
             slack_client.send_message(UPDATE_CHANNEL, 'Unhandled exception.')
@@ -0,0 +1,88 @@
+'''
+In-memory index of which users are in which channels, and which users
+are active humans.
+'''
+
+from collections import defaultdict
+from typing import Dict, Optional, Set
+
+
+class Membership:
+    '''
+    Membership maps channels to their members and users to their channels.
+    It is seeded from the API and then kept current from
+    member_joined_channel and member_left_channel events. Slack only sends
+    those for channels we are in, so only those channels are indexed.
+    Whether users are active humans is seeded from users.list and kept
+    current from user_change and team_join events.
+    '''
+
+    def __init__(self) -> None:
+        self.members: Dict[str, Set[str]] = {}
+        self.channels: Dict[str, Set[str]] = defaultdict(set)
+        self.humans: Dict[str, bool] = {}
+
+    def clear(self):
+        '''
+        Forgets everything, e.g. after missing events while disconnected.
+        '''
+        self.members.clear()
+        self.channels.clear()
+        self.humans.clear()
+
+    def update_user(self, user):
+        '''
+        Records whether user, as returned by users.info, is an active human.
+        '''
+        self.humans[user['id']] = not user.get('deleted', False) and not user.get('is_bot', False)
+
+    def is_active_and_human(self, user: str) -> Optional[bool]:
+        '''
+        Returns whether user is an active human, or None if we don't know.
+        '''
+        return self.humans.get(user)
+
+    def seed(self, channel: str, members):
+        '''
+        Replaces what we know about channel with members.
+        '''
+        self.drop(channel)
+        self.members[channel] = set(members)
+        for user in self.members[channel]:
+            self.channels[user].add(channel)
+
+    def drop(self, channel: str):
+        '''
+        Stops indexing channel.
+        '''
+        for user in self.members.pop(channel, set()):
+            self.channels[user].discard(channel)
+
+    def join(self, user: str, channel: str):
+        '''
+        Records user joining channel.
+        '''
+        if channel in self.members:
+            self.members[channel].add(user)
+            self.channels[user].add(channel)
+
+    def leave(self, user: str, channel: str):
+        '''
+        Records user leaving channel.
+        '''
+        if channel in self.members:
+            self.members[channel].discard(user)
+            self.channels[user].discard(channel)
+
+    def users_in(self, channel: str) -> Set[str]:
+        '''
+        Returns the members of channel. The set is live, so don't modify it.
+        '''
+        return self.members[channel]
+
+    def channels_of(self, user: str) -> Set[str]:
+        '''
+        Returns the indexed channels user is in. The set is live, so don't
+        modify it.
+        '''
+        return self.channels.get(user, set())
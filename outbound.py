@@ -0,0 +1,71 @@
+'''
+Batches replies so that a burst of them turns into a single message.
+'''
+
+import logging
+import time
+from typing import Dict, List, Tuple
+
+from slack import ApiCallException, CircuitOpenException
+
+# Slack starts truncating messages well past this, but this is what it
+# recommends staying under.
+MAX_MESSAGE_LENGTH = 4000
+
+
+class Outbox:
+    '''
+    Holds replies to a channel for window seconds and sends everything
+    that arrived in the meantime as one message, starting a new message
+    whenever the next reply would take it over MAX_MESSAGE_LENGTH.
+    '''
+
+    def __init__(self, scheduler, window: float) -> None:
+        self.scheduler = scheduler
+        self.window = window
+        # Each batch remembers its deadline, so the timer of a batch which
+        # was flushed early does not cut the next one short.
+        self.buffers: Dict[str, Tuple[object, List[str], float]] = {}
+
+    def send(self, slack_client, channel, text: str):
+        '''
+        Queues text to be sent to channel.
+        '''
+        if channel in self.buffers:
+            _, lines, _ = self.buffers[channel]
+            if sum(len(line) + 1 for line in lines) + len(text) <= MAX_MESSAGE_LENGTH:
+                lines.append(text)
+                return
+            self.flush(channel)
+
+        deadline = time.time() + self.window
+        self.buffers[channel] = (slack_client, [text], deadline)
+        self.scheduler.at(deadline, lambda: self._expire(channel, deadline))
+
+    def _expire(self, channel, deadline: float):
+        if channel in self.buffers and self.buffers[channel][2] == deadline:
+            self.flush(channel)
+
+    def flush_all(self):
+        '''
+        Sends everything that is queued, e.g. before the process goes away.
+        '''
+        for channel in list(self.buffers):
+            self.flush(channel)
+
+    def flush(self, channel):
+        '''
+        Sends whatever is queued for channel.
+        '''
+        if channel not in self.buffers:
+            return
+        slack_client, lines, _ = self.buffers.pop(channel)
+        text = '\n'.join(lines)
+        try:
+            slack_client.send_message(channel, text)
+        except CircuitOpenException as circuit_open:
+            logging.warning(circuit_open)
+            self.scheduler.at(circuit_open.retry_at,
+                              lambda: self.send(slack_client, channel, text))
+        except ApiCallException as api_call_exception:
+            logging.warning(api_call_exception)
@@ -0,0 +1,69 @@
+'''
+On-demand profiling of the running process. Both profilers return text in
+the collapsed stack format ("frame;frame;frame weight" per line) so the
+output can be fed straight into flamegraph tools.
+'''
+
+import sys
+import time
+import tracemalloc
+from collections import Counter
+
+SAMPLE_INTERVAL = 0.005
+TOP = 50
+
+
+def _frame_name(filename: str, name: str) -> str:
+    return f'{filename.rsplit("/", 1)[-1]}:{name}'
+
+
+def sample_stacks(thread_id: int, seconds: float) -> Counter:
+    '''
+    Samples the stack of thread_id every SAMPLE_INTERVAL seconds for
+    seconds and counts how often each stack was seen.
+    '''
+    counts: Counter = Counter()
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        stack = []
+        while frame is not None:
+            stack.append(_frame_name(frame.f_code.co_filename, frame.f_code.co_name))
+            frame = frame.f_back
+        if stack:
+            counts[';'.join(reversed(stack))] += 1
+        time.sleep(SAMPLE_INTERVAL)
+    return counts
+
+
+def collapse(counts: Counter) -> str:
+    '''
+    Returns the TOP most common stacks in collapsed stack format.
+    '''
+    return '\n'.join(f'{stack} {count}' for stack, count in counts.most_common(TOP))
+
+
+def allocation_diff(seconds: float) -> str:
+    '''
+    Returns the TOP allocation sites which grew the most over seconds in
+    collapsed stack format, weighted by bytes.
+    '''
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start(25)
+    try:
+        before = tracemalloc.take_snapshot()
+        time.sleep(seconds)
+        after = tracemalloc.take_snapshot()
+    finally:
+        if started:
+            tracemalloc.stop()
+
+    lines = []
+    grown = [stat for stat in after.compare_to(before, 'traceback') if stat.size_diff > 0]
+    for stat in grown[:TOP]:
+        # Traceback frames are already ordered from oldest to newest.
+        stack = ';'.join(_frame_name(frame.filename, str(frame.lineno))
+                         for frame in stat.traceback)
+        lines.append(f'{stack} {stat.size_diff}')
+    return '\n'.join(lines)
@@ -0,0 +1,61 @@
+'''
+Keeps vote prompts up to date without editing them on every reaction.
+'''
+
+import logging
+import time
+from typing import Dict, Tuple
+
+from slack import ApiCallException, get_id
+
+
+class ProgressUpdater:
+    '''
+    Coalesces edits to a message. The first update is written straight
+    away, then at most one edit per delay seconds carries the latest text.
+    '''
+
+    def __init__(self, scheduler, delay: float) -> None:
+        self.scheduler = scheduler
+        self.delay = delay
+        self.pending: Dict[str, Tuple] = {}
+        self.written: Dict[str, Tuple[float, str]] = {}
+
+    def update(self, slack_client, message, text: str):
+        '''
+        Sets the text message should show soon.
+        '''
+        key = get_id(message)
+        scheduled = key in self.pending
+        self.pending[key] = (slack_client, message, text)
+        if not scheduled:
+            written_at, _ = self.written.get(key, (0.0, None))
+            self.scheduler.at(max(time.time(), written_at + self.delay),
+                              lambda: self._flush(key))
+
+    def finish(self, slack_client, message, text: str):
+        '''
+        Writes the final text for message right away and forgets about it.
+        '''
+        key = get_id(message)
+        self.pending.pop(key, None)
+        self.written.pop(key, None)
+        self._write(slack_client, message, text)
+
+    def _flush(self, key: str):
+        entry = self.pending.pop(key, None)
+        if entry is None:
+            # Finished in the meantime.
+            return
+        slack_client, message, text = entry
+        _, written_text = self.written.get(key, (0.0, None))
+        if text != written_text:
+            self.written[key] = (time.time(), text)
+            self._write(slack_client, message, text)
+
+    @staticmethod
+    def _write(slack_client, message, text: str):
+        try:
+            slack_client.update_message(message['channel'], message['ts'], text)
+        except ApiCallException as api_call_exception:
+            logging.warning(api_call_exception)
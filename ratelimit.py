@@ -0,0 +1,50 @@
+'''
+Per-user sliding window rate limiting for incoming messages.
+'''
+
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Tuple
+
+
+class RateLimiter:
+    '''
+    Allows each user at most count messages per period seconds for every
+    command with its own limit, and shares the default limit between all
+    other commands. Each (user, command) keeps a ring buffer of its last
+    count timestamps, and only max_users of those are kept around.
+    '''
+
+    def __init__(self, limits: Dict[str, Tuple[int, float]],
+                 default: Tuple[int, float], max_users: int) -> None:
+        self.limits = limits
+        self.default = default
+        self.max_users = max_users
+        self.windows: 'OrderedDict[Tuple[str, str], Deque[float]]' = OrderedDict()
+
+    def allow(self, user: str, name: str) -> bool:
+        '''
+        Returns true if user may send another name message right now and
+        counts it if so.
+        '''
+        bucket = name if name in self.limits else ''
+        count, period = self.limits.get(bucket, self.default)
+        now = time.time()
+
+        key = (user, bucket)
+        window = self.windows.get(key)
+        if window is None:
+            window = deque(maxlen=count)
+            self.windows[key] = window
+            if len(self.windows) > self.max_users:
+                # Forget whoever has been quiet the longest.
+                self.windows.popitem(last=False)
+        else:
+            self.windows.move_to_end(key)
+
+        # The ring buffer is full and its oldest entry is still inside the
+        # window, so this would be message count + 1 within period.
+        if len(window) == count and now - window[0] < period:
+            return False
+        window.append(now)
+        return True
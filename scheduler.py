@@ -0,0 +1,101 @@
+'''
+A small heap based scheduler. Jobs are kept ordered by deadline so
+checking for due work is a single peek at the top of the heap.
+'''
+
+import heapq
+import itertools
+import shelve
+import time
+from typing import Callable, List, Optional, Set, Tuple
+
+
+class Scheduler:
+    '''
+    Runs functions at (or every so often after) a deadline. One-off jobs
+    created with persist survive restarts, everything else lives in memory.
+    '''
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.heap: List[Tuple[float, int, Callable, Optional[float]]] = []
+        self.counter = itertools.count()
+        self.dispatch: Optional[Callable] = None
+        self.queued: Set[str] = set()
+
+    def _push(self, deadline: float, fn, interval: Optional[float] = None):
+        heapq.heappush(self.heap, (deadline, next(self.counter), fn, interval))
+
+    def every(self, interval: float, fn):
+        '''
+        Runs fn every interval seconds, starting interval seconds from now.
+        '''
+        self._push(time.time() + interval, fn, interval)
+
+    def at(self, deadline: float, fn):
+        '''
+        Runs fn once at deadline. Not persisted.
+        '''
+        self._push(deadline, fn)
+
+    def persist(self, deadline: float, payload):
+        '''
+        Hands payload to dispatch once at deadline. The payload is written
+        to disk so it must be picklable.
+        '''
+        key = f'{time.time()}-{next(self.counter)}'
+        with shelve.open(self.path) as shelve_db:
+            shelve_db[key] = (deadline, payload)
+        self.queued.add(key)
+        self._push(deadline, self._persisted_job(key, payload))
+
+    def load(self, dispatch: Callable):
+        '''
+        Sets the function persisted payloads are handed to and queues up
+        every payload which is not queued yet, e.g. left over from a
+        previous run or written by another instance.
+        '''
+        self.dispatch = dispatch
+        with shelve.open(self.path) as shelve_db:
+            for key, (deadline, payload) in shelve_db.items():
+                if key not in self.queued:
+                    self.queued.add(key)
+                    self._push(deadline, self._persisted_job(key, payload))
+
+    def _persisted_job(self, key: str, payload):
+        def _job():
+            # Forget the job before running it so a failure can not make
+            # it run again on every restart. If it is already gone someone
+            # else ran it.
+            self.queued.discard(key)
+            with shelve.open(self.path) as shelve_db:
+                if key not in shelve_db:
+                    return
+                del shelve_db[key]
+            if self.dispatch is not None:
+                self.dispatch(payload)
+        return _job
+
+    def idle_time(self, max_sleep: float) -> float:
+        '''
+        Returns how long we can sleep for, at most max_sleep, before the
+        next job is due.
+        '''
+        if not self.heap:
+            return max_sleep
+        return min(max_sleep, max(0.0, self.heap[0][0] - time.time()))
+
+    def run_pending(self, guard: Optional[Callable] = None):
+        '''
+        Runs every job whose deadline has passed. guard is called before
+        each job and can raise to stop running them, leaving the rest due.
+        '''
+        now = time.time()
+        while self.heap and self.heap[0][0] <= now:
+            if guard is not None:
+                guard()
+            _, _, fn, interval = heapq.heappop(self.heap)
+            # Reschedule before running so a raising job keeps its slot.
+            if interval is not None:
+                self._push(now + interval, fn, interval)
+            fn()
@@ -2,17 +2,46 @@
 Wrapper around slack client so that we can test easily.
 '''
 
+import json
+import os
+import time
 from functools import lru_cache
+from html.parser import HTMLParser
+from typing import Dict
+from urllib.parse import urljoin
+
+import requests
+from requests.exceptions import RequestException
 from slackclient import SlackClient
 from selenium import webdriver
 
 import config
+from breaker import CircuitBreaker
+from lease import LeaseLostException
+from membership import Membership
+
+# driver is used for logging in to the Admin website, which we need for
+# options that are not exposed via. an API, such as updating the
+# workspace name. It is only started the first time we need to log in.
+driver = None
+
+# FIXME(joey): Badmin login details. Ideally this comes from
+# environment variables.
+SLACK_TEAM = "some_slack_team"
+BADMIN_LOGIN = "some@email.com"
+BADMIN_PASSWORD = "xxxx"
+ADMIN_NAME_URL = f'https://{SLACK_TEAM}.slack.com/admin/name'
+
 
-# driver is used for accessing Admin options that are not exposed via.
-# an API, such as updating the workspace name.
-driver = webdriver.PhantomJS()
-# TBH, not sure if this is required.
-driver.set_window_size(1024, 768)
+# Errors which say Slack is struggling rather than that we asked for
+# something silly.
+TRANSIENT_ERRORS = {'ratelimited', 'service_unavailable', 'fatal_error',
+                    'internal_error', 'request_timeout'}
+
+# Methods which change the workspace, so only the instance holding the
+# lease may call them. Messages are left out so that replies about work
+# which already happened still go out after losing the lease.
+LEASED_METHODS = {'channels.rename', 'channels.kick', 'users.admin.invite', 'chat.delete'}
 
 
 class ApiCallException(Exception):
@@ -22,6 +51,161 @@ class ApiCallException(Exception):
     pass
 
 
+class TransientApiCallException(ApiCallException):
+    '''
+    Used for when an API call failed because Slack or the network is
+    struggling, so trying again later may well work.
+    '''
+    pass
+
+
+class CircuitOpenException(TransientApiCallException):
+    '''
+    Used for when an API call was not attempted because its circuit
+    breaker is open. retry_at is when it is worth trying again.
+    '''
+
+    def __init__(self, method, retry_at):
+        super(CircuitOpenException, self).__init__(f'circuit open for {method}')
+        self.method = method
+        self.retry_at = retry_at
+
+
+class _FormParser(HTMLParser):
+    '''
+    Finds the form containing the input with the given id and collects
+    its action and the names and values of its inputs.
+    '''
+
+    def __init__(self, input_id):
+        super(_FormParser, self).__init__()
+        self.input_id = input_id
+        self.in_form = False
+        self.action = None
+        self.fields = {}
+        self.input_name = None
+        self.found = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'form':
+            self.in_form = True
+            self.action = attrs.get('action')
+            self.fields = {}
+            self.input_name = None
+        elif tag == 'input' and self.in_form and 'name' in attrs:
+            self.fields[attrs['name']] = attrs.get('value') or ''
+            if attrs.get('id') == self.input_id:
+                self.input_name = attrs['name']
+
+    def handle_endtag(self, tag):
+        if tag == 'form' and self.in_form:
+            self.in_form = False
+            if self.input_name is not None and self.found is None:
+                self.found = (self.action, self.fields, self.input_name)
+
+
+class AdminSession:
+    '''
+    An authenticated session for the Slack Admin website. Cookies are kept
+    on disk and we only log in again, through the browser, once Slack stops
+    accepting them. Forms are then submitted as plain HTTP requests.
+    '''
+
+    def __init__(self, cookie_path):
+        self.cookie_path = cookie_path
+        self.session = requests.Session()
+        if os.path.exists(cookie_path):
+            with open(cookie_path) as cookie_file:
+                for cookie in json.load(cookie_file):
+                    self.session.cookies.set(
+                        cookie['name'], cookie['value'],
+                        domain=cookie.get('domain'), path=cookie.get('path', '/'))
+
+    def _save(self):
+        cookies = [{'name': c.name, 'value': c.value, 'domain': c.domain, 'path': c.path}
+                   for c in self.session.cookies]
+        # These are as good as the admin's password, so never let anyone
+        # else read them, not even between creating the file and writing it.
+        fd = os.open(self.cookie_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        # The mode only applies to new files, so tighten older ones too.
+        os.fchmod(fd, 0o600)
+        with os.fdopen(fd, 'w') as cookie_file:
+            json.dump(cookies, cookie_file)
+
+    def _login(self):
+        '''
+        Logs in through the browser and copies its cookies into our session.
+        '''
+        global driver
+        if driver is None:
+            driver = webdriver.PhantomJS()
+            # TBH, not sure if this is required.
+            driver.set_window_size(1024, 768)
+
+        # Remove any expired session so that we get the login form.
+        driver.delete_all_cookies()
+        driver.get(ADMIN_NAME_URL)
+
+        login_form_password = driver.find_element_by_id('password')
+        login_form_submit = driver.find_element_by_id('signin_btn')
+
+        # Enter the email into the form. Sadly, this workaround is
+        # required because sending keys to the email field does nothing.
+        # An educated guess is that phantomJS does not interact
+        # correctly with HTML5 validated fields, in paritcular, HTML5
+        # email validation.
+        driver.execute_script(
+            "document.getElementById('{}').value='{}'".format("email", BADMIN_LOGIN))
+
+        # Fill in the password field.
+        login_form_password.clear()
+        login_form_password.send_keys(BADMIN_PASSWORD)
+
+        # Submit the login form.
+        login_form_submit.click()
+
+        self.session.cookies.clear()
+        for cookie in driver.get_cookies():
+            self.session.cookies.set(
+                cookie['name'], cookie['value'],
+                domain=cookie.get('domain'), path=cookie.get('path', '/'))
+        self._save()
+
+    def _find_form(self, url, input_id):
+        '''
+        Returns the form on url containing input_id, or None if the page
+        does not have it, e.g. because we were sent to the login page.
+        '''
+        response = self.session.get(url, timeout=config.API_TIMEOUT)
+        parser = _FormParser(input_id)
+        parser.feed(response.text)
+        return parser.found
+
+    def submit(self, url, input_id, value, guard=None):
+        '''
+        Submits the form on url containing input_id with value filled in,
+        logging in first if our cookies have expired. guard is called
+        right before submitting and can raise to stop us.
+        '''
+        form = self._find_form(url, input_id)
+        if form is None:
+            self._login()
+            form = self._find_form(url, input_id)
+        if form is None:
+            raise ApiCallException(f'could not find {input_id} on {url}')
+
+        action, fields, input_name = form
+        fields[input_name] = value
+        if guard is not None:
+            guard()
+        response = self.session.post(
+            urljoin(url, action or url), data=fields, timeout=config.API_TIMEOUT)
+        if not response.ok:
+            raise ApiCallException(f'{url} returned {response.status_code}')
+        return response
+
+
 class Client(SlackClient):
     '''
     Wrapper around SlackClient.
@@ -29,12 +213,58 @@ class Client(SlackClient):
 
     def __init__(self, token):
         super(Client, self).__init__(token)
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.membership = Membership()
+        self.admin_session = AdminSession(config.ADMIN_COOKIES)
+        # Set when running as one of several instances, see LEASED_METHODS.
+        self.lease = None
         self.admin_channel = self.get_channel_by_name(config.CHANNEL)
         response = self.api_call('auth.test')
         if not response['ok']:
             raise Exception('could not get self')
         self.self = response['user_id']
 
+    def api_call(self, method, **kwargs):
+        '''
+        Calls method through its circuit breaker. Raises
+        CircuitOpenException straight away while the breaker is open, and
+        TransientApiCallException if the call timed out or Slack answered
+        with one of TRANSIENT_ERRORS.
+        '''
+        breaker = self.breakers.get(method)
+        if breaker is None:
+            breaker = CircuitBreaker(config.BREAKER_THRESHOLD, config.BREAKER_RESET)
+            self.breakers[method] = breaker
+        if method in LEASED_METHODS:
+            self.check_lease()
+        if not breaker.allow():
+            raise CircuitOpenException(method, max(breaker.retry_at(), time.time() + 1))
+
+        # Whatever happens the breaker hears about it, otherwise a half open
+        # breaker would wait on its probe forever.
+        succeeded = False
+        try:
+            response = super(Client, self).api_call(
+                method, timeout=config.API_TIMEOUT, **kwargs)
+            succeeded = response.get('error') not in TRANSIENT_ERRORS
+        except (RequestException, ValueError) as exception:
+            raise TransientApiCallException(f'{method} failed: {exception}')
+        finally:
+            if succeeded:
+                breaker.success()
+            else:
+                breaker.failure()
+        if not succeeded:
+            raise TransientApiCallException(f'{method} failed: {response["error"]}')
+        return response
+
+    def check_lease(self):
+        '''
+        Raises LeaseLostException if another instance may have taken over.
+        '''
+        if self.lease is not None and not self.lease.held():
+            raise LeaseLostException(self.lease.name)
+
     def send_message(self, channel, text):
         '''
         Posts text to the given channel.
@@ -47,6 +277,29 @@ class Client(SlackClient):
         ))
         return response
 
+    def update_message(self, channel, ts, text):
+        '''
+        Replaces the text of a message we sent.
+        '''
+        return check(self.api_call(
+            'chat.update',
+            channel=channel,
+            ts=ts,
+            text=text,
+            as_user=True
+        ))
+
+    def upload_file(self, channel, filename, content):
+        '''
+        Uploads content as a file to the given channel.
+        '''
+        return check(self.api_call(
+            'files.upload',
+            channels=channel,
+            filename=filename,
+            content=content
+        ))
+
     def send_dm(self, user_name, text):
         '''
         Takes a user_name (not ID) and sends them a DM.
@@ -66,13 +319,63 @@ class Client(SlackClient):
 
         raise ApiCallException(response)
 
+    def seed_membership(self):
+        '''
+        Rebuilds the membership index for every channel we are in, and
+        for every user whether they are an active human.
+        '''
+        response = check(self.api_call('channels.list'))
+        users = check(self.api_call('users.list', presence=False))
+        self.membership.clear()
+        for channel in response['channels']:
+            if channel.get('is_member', False):
+                self.membership.seed(channel['id'], channel.get('members', []))
+        for user in users['members']:
+            self.membership.update_user(user)
+
+    def on_user_changed(self, user):
+        '''
+        Updates the membership index when a user joins the team or changes,
+        e.g. is deactivated.
+        '''
+        self.membership.update_user(user)
+
+    def on_member_joined(self, user, channel):
+        '''
+        Updates the membership index when someone joins a channel.
+        '''
+        if user == self.self:
+            response = check(self.api_call('channels.info', channel=channel))
+            self.membership.seed(channel, response['channel']['members'])
+        else:
+            self.membership.join(user, channel)
+
+    def on_member_left(self, user, channel):
+        '''
+        Updates the membership index when someone leaves a channel.
+        '''
+        if user == self.self:
+            # We will not hear about this channel any more.
+            self.membership.drop(channel)
+        else:
+            self.membership.leave(user, channel)
+
     def get_users_in_channel(self, channel):
         '''
-        Returns a set of users in a channel.
+        Returns a set of users in a channel. Channels we are in come from
+        the membership index, so the set must not be modified.
         '''
+        if channel in self.membership.members:
+            return self.membership.users_in(channel)
         response = check(self.api_call('channels.info', channel=channel))
         return set(response['channel']['members'])
 
+    def get_channels_for_user(self, user):
+        '''
+        Returns the set of channels we are in which user is also in.
+        '''
+        return self.membership.channels_of(user)
+
     def get_channel_by_name(self, channel_name):
         '''
         Returns channel_name's channel ID.
@@ -84,6 +387,13 @@ class Client(SlackClient):
 
         raise ApiCallException(response)
 
+    def channel_name_exists(self, channel_name):
+        '''
+        Returns true if a channel called channel_name exists.
+        '''
+        response = check(self.api_call('channels.list', exclude_members=True))
+        return any(channel['name'] == channel_name for channel in response['channels'])
+
     def get_channel_name(self, channel):
         '''
         Returns the name for the given channel.
@@ -155,14 +465,17 @@ class Client(SlackClient):
         response = check(self.api_call('users.info', user=user))
         return response['user']['is_bot']
 
-    @lru_cache()
     def is_active_and_human(self, user):
         '''
-        Returns true if the user is active and human.
+        Returns true if the user is active and human. Users are looked up
+        in the membership index, and only fetched if it has not heard of them.
         '''
+        known = self.membership.is_active_and_human(user)
+        if known is not None:
+            return known
         response = check(self.api_call('users.info', user=user))
-        user_info = response['user']
-        return not user_info['deleted'] and not user_info['is_bot']
+        self.membership.update_user(response['user'])
+        return self.membership.is_active_and_human(user)
 
     def ping(self):
         '''
@@ -172,56 +485,12 @@ class Client(SlackClient):
 
     def update_team_name(self):
         '''
-        Updates a team name on Slack. It uses a phantomJS browser to do
-        this through the Slack Admin website.
+        Updates a team name on Slack through the Slack Admin website.
         '''
-
         new_workspace_name = "lalala"
-        # FIXME(joey): Badmin login details. Ideally this comes from
-        # environment variables.
-        SLACK_TEAM = "some_slack_team"
-        BADMIN_LOGIN = "some@email.com"
-        BADMIN_PASSWORD = "xxxx"
-
-        # Delete all cookies to remove the past login session. This
-        # ensures that we log in as expected every time.
-        # TODO(joey): We can instead detect whether we need to log in
-        # again (i.e. a redirect).
-        driver.delete_all_cookies()
-        # Open the slack admin page.
-        driver.get(
-            'https://{slackTeam}.slack.com/admin/name'.format(slackTeam=SLACK_TEAM))
-
-        login_form_email = driver.find_element_by_id('email')
-        login_form_password = driver.find_element_by_id('password')
-        login_form_submit = driver.find_element_by_id('signin_btn')
-
-        # Enter the email into the form. Sadly, this workaround is
-        # required because sending keys to the email field does nothing.
-        # An educated guess is that phantomJS does not interact
-        # correctly with HTML5 validated fields, in paritcular, HTML5
-        # email validation.
-        driver.execute_script(
-            "document.getElementById('{}').value='{}'".format("email", BADMIN_LOGIN))
-
-        # Fill in the password field.
-        login_form_password.clear()
-        login_form_password.send_keys(BADMIN_PASSWORD)
-
-        # Submit the login form.
-        login_form_submit.click()
-
-        # We have now navigated to the Workspace Name and URL setting page.
-        workspace_form_team_name = driver.find_element_by_id('team_name_input')
-        workspace_form_submit = driver.find_element_by_id('submit_btn')
-
-        workspace_form_team_name.clear()
-        workspace_form_team_name.send_keys(new_workspace_name)
-
-        # Submit the new workspace page.
-        workspace_form_submit.click()
+        self.admin_session.submit(ADMIN_NAME_URL, 'team_name_input', new_workspace_name,
+                                  guard=self.check_lease)
 
-        # TODO(joey): Detect if we have encountered an error.
 
 def get_id(event):
     '''
@@ -243,10 +512,11 @@ def check(response):
 def get_reaction_sum(event):
     '''
     Returns the number of thumbs up - the number of thumbs down given
-    an event with a message key which has a reaction key.
+    an event with a message key. Slack leaves out the message's reactions
+    key when it has none.
     '''
     count = 0
-    for reaction in event['message']['reactions']:
+    for reaction in event['message'].get('reactions', []):
         if reaction['name'] == '+1':
             count += reaction['count']
         elif reaction['name'] == '-1':
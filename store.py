@@ -1,10 +1,13 @@
 '''
-A minimal wrapper around shelve to remove the tiniest amount of boilerplate.
+A minimal wrapper around shelve to remove the tiniest amount of boilerplate,
+and a SQLite backed store for state shared between instances.
 '''
 
+import pickle
 import shelve
+import sqlite3
 
-from config import DB
+from config import DB, STATE_DB
 from util import log
 
 class DiskStore:
@@ -31,3 +34,35 @@ class DiskStore:
         '''
         with shelve.open(DB) as shelve_db:
             shelve_db[key] = val
+
+
+class VoteStore:
+    '''
+    Vote store keeps pending votes in STATE_DB so that they survive
+    restarts and can be picked up by a standby instance.
+    '''
+
+    def __init__(self) -> None:
+        self.connection = sqlite3.connect(STATE_DB, isolation_level=None)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS votes (id TEXT PRIMARY KEY, vote BLOB)')
+
+    def put(self, key, vote):
+        '''
+        Stores a pending vote.
+        '''
+        self.connection.execute(
+            'INSERT OR REPLACE INTO votes (id, vote) VALUES (?, ?)', (key, pickle.dumps(vote)))
+
+    def delete(self, key):
+        '''
+        Forgets a pending vote.
+        '''
+        self.connection.execute('DELETE FROM votes WHERE id = ?', (key,))
+
+    def all(self):
+        '''
+        Returns every pending vote keyed by id.
+        '''
+        rows = self.connection.execute('SELECT id, vote FROM votes').fetchall()
+        return {key: pickle.loads(vote) for key, vote in rows}
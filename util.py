@@ -3,6 +3,11 @@ Random utilities that are irrelevant of slack.
 '''
 import logging
 import inspect
+import re
+import time
+from typing import Optional
+
+DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
 
 def log(fn):
     '''
@@ -26,3 +31,41 @@ def log(fn):
         logging.info(f'[function={fn.__name__}][result={result}]')
         return result
     return logged_fn
+
+
+def parse_duration(input_string: str) -> Optional[int]:
+    '''
+    Input format: 2h, 90s, 1d12h. Returns the number of seconds or None.
+    '''
+    parts = re.findall(r'(\d+)([smhd])', input_string)
+    if not parts or ''.join(n + u for n, u in parts) != input_string:
+        return None
+    return sum(int(n) * DURATION_UNITS[u] for n, u in parts)
+
+
+def format_duration(seconds: float) -> str:
+    '''
+    Output format: 6d, 5h, 3m. Only the largest whole unit is shown.
+    '''
+    for unit, size in sorted(DURATION_UNITS.items(), key=lambda item: -item[1]):
+        if seconds >= size:
+            return f'{int(seconds // size)}{unit}'
+    return '0s'
+
+
+def parse_time_of_day(input_string: str) -> Optional[float]:
+    '''
+    Input format: 17:00. Returns the timestamp of the next time the local
+    clock reads input_string, or None.
+    '''
+    match = re.fullmatch(r'(?P<hour>\d{1,2}):(?P<minute>\d{2})', input_string)
+    if not match:
+        return None
+    hour, minute = int(match.group('hour')), int(match.group('minute'))
+    if hour > 23 or minute > 59:
+        return None
+    now = time.localtime()
+    deadline = time.mktime(now[:3] + (hour, minute, 0, 0, 0, -1))
+    if deadline <= time.time():
+        deadline += DURATION_UNITS['d']
+    return deadline